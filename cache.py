@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import orjson
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration from Environment Variables ---
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Per-endpoint freshness policies, overridable per deployment.
+CACHE_TTL_PAGES = int(os.getenv("CACHE_TTL_PAGES", "300"))
+CACHE_TTL_RECOMMENDATIONS = int(os.getenv("CACHE_TTL_RECOMMENDATIONS", "60"))
+CACHE_TTL_STORE_NAME = int(os.getenv("CACHE_TTL_STORE_NAME", "3600"))
+
+# Short socket timeouts so a missing Redis degrades to a direct upstream
+# call instead of stalling the request.
+_redis = redis.from_url(REDIS_URL, socket_connect_timeout=1, socket_timeout=1)
+
+
+def _stale_key(key: str) -> str:
+    return f"{key}:stale"
+
+
+# Single-flight table mirroring the one in knowledge_base: concurrent
+# misses on the same key await one upstream fetch instead of each hitting
+# Shopify before the cache entry lands.
+_INFLIGHT: dict = {}
+
+
+async def cached(key: str, ttl: int, fn):
+    """
+    Returns the Redis-cached value for key, or runs fn() on a miss and
+    stores the result with the given TTL.
+
+    Concurrent calls for the same key are coalesced into one lookup. A
+    second copy is kept without expiry so that when the upstream fails
+    (fn returns a falsy result), the last known value is served instead of
+    an empty answer. If Redis itself is unreachable, fn() is called
+    directly.
+    """
+    inflight = _INFLIGHT.get(key)
+    if inflight is not None:
+        return await inflight
+
+    future = asyncio.get_running_loop().create_future()
+    _INFLIGHT[key] = future
+    try:
+        value = await _lookup(key, ttl, fn)
+        future.set_result(value)
+        return value
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        _INFLIGHT.pop(key, None)
+
+
+async def _lookup(key: str, ttl: int, fn):
+    """The uncoalesced cache lookup behind cached()."""
+    try:
+        hit = await _redis.get(key)
+        if hit is not None:
+            return orjson.loads(hit)
+    except Exception:
+        logger.warning("Redis unavailable for %s; calling upstream directly.", key)
+        return await fn()
+
+    value = await fn()
+    if value:
+        payload = orjson.dumps(value)
+        try:
+            await _redis.setex(key, ttl, payload)
+            await _redis.set(_stale_key(key), payload)
+        except Exception:
+            logger.warning("Failed to store %s in Redis.", key)
+        return value
+
+    # Upstream came back empty; fall back to the last good value if any.
+    try:
+        stale = await _redis.get(_stale_key(key))
+        if stale is not None:
+            logger.warning("Upstream failed for %s; serving stale cached value.", key)
+            return orjson.loads(stale)
+    except Exception:
+        pass
+    return value
+
+
+async def conditional_get(key: str, fetch) -> bytes:
+    """
+    HTTP conditional-request layer for Shopify polling calls.
+
+    Remembers the ETag and body of the last 200 response under key and sends
+    If-None-Match on the next call; a 304 is mapped back onto the stored
+    body, so unchanged data costs a ~200-byte exchange instead of a full
+    JSON download and re-parse.
+
+    fetch(extra_headers) must perform the GET with the extra headers merged
+    in and return the response. Returns the response body as bytes; raises
+    for HTTP error statuses. If Redis is unreachable the request is simply
+    sent unconditionally.
+    """
+    etag = body = None
+    try:
+        etag, body = await _redis.hmget(key, "etag", "body")
+    except Exception:
+        pass
+
+    extra_headers = {"If-None-Match": etag.decode()} if etag and body else {}
+    response = await fetch(extra_headers)
+    if response.status_code == 304 and body is not None:
+        return body
+    response.raise_for_status()
+
+    new_etag = response.headers.get("ETag")
+    if new_etag:
+        try:
+            await _redis.hset(key, mapping={"etag": new_etag, "body": response.content})
+        except Exception:
+            logger.warning("Failed to store ETag for %s in Redis.", key)
+    return response.content
+
+
+async def invalidate(pattern: str = "shopify:*") -> int:
+    """Deletes all cached keys matching pattern; returns how many were removed."""
+    removed = 0
+    try:
+        async for key in _redis.scan_iter(match=pattern):
+            removed += await _redis.delete(key)
+    except Exception:
+        logger.warning("Redis unavailable; nothing to invalidate.")
+    return removed
+
+
+async def close_redis() -> None:
+    """Closes the Redis connection pool; called from the app's shutdown hook."""
+    try:
+        await _redis.aclose()
+    except Exception:
+        pass
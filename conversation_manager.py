@@ -1,23 +1,24 @@
+import logging
 import os
 import re
-import requests
-from typing import Dict, Any
+from selectolax.parser import HTMLParser
+from typing import AsyncIterator, Dict, Any
 
 # --- Placeholder for your AI/Claude API module ---
 # from claude_api import get_conversational_response, answer_question_from_text
 
 # --- Updated Import ---
+from intents import classify_intent, match_intents
 from knowledge_base import get_shopify_page_by_handle, track_order_in_shopify, fetch_shopify_recommendations
+from response_cache import get_cached_response, store_response
+
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 SHOPIFY_STORE_URL = os.getenv("SHOPIFY_STORE_URL")
 
-# --- Keyword Definitions ---
-GREETING_KEYWORDS = {"hej", "hi", "hello", "hey", "tja", "good morning", "good evening"}
-ORDER_TRACKING_KEYWORDS = {"track", "order", "spåra", "beställning", "where is my order", "status"}
-POLICY_KEYWORDS = {"policy", "return", "retur", "shipping", "frakt", "policy", "terms", "rules", "villkor"}
-RECOMMENDATION_KEYWORDS = {"recommend", "rekommendera", "suggest", "product", "produkt", "looking for"}
-
+# --- Precompiled hot-path regexes ---
+_ORDER_NUMBER_RE = re.compile(r'(\d{4,})')
 
 # ... (AI Placeholders and Utility functions remain the same) ...
 async def get_conversational_response(query: str) -> str:
@@ -34,36 +35,62 @@ async def answer_question_from_text(document_text: str, question: str) -> str:
 
 
 def clean_html(raw_html: str) -> str:
-    clean_text = re.sub('<[^<]+?>', '', raw_html)
-    return clean_text.strip()
-
-
-async def scrape_product_image_url(product_url: str) -> str | None:
-    try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        response = requests.get(product_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        match = re.search(r'<meta property="og:image" content="([^"]+)"', response.text)
-        if match:
-            return match.group(1)
-    except requests.RequestException as e:
-        print(f"ERROR: Could not fetch product page {product_url}. Details: {e}")
-    return None
+    # selectolax parses in C, so this is far faster than a tag-stripping
+    # regex and immune to pathological markup.
+    return HTMLParser(raw_html).text(separator=' ').strip()
 
 
 # ==========================================================
 
 async def handle_conversation(query: str, store_name: str) -> Dict[str, Any]:
-    query_lower = query.lower().strip()
+    # Most chat turns are already lowercase ASCII with no edge whitespace;
+    # skip the normalization allocations on that fast path.
+    if query[:1].isspace() or query[-1:].isspace():
+        query = query.strip()
+    query_lower = query if query.isascii() and query.islower() else query.lower()
+
+    # --- 0. Semantic cache: near-duplicate queries skip the whole pipeline ---
+    cached = get_cached_response(query_lower)
+    if cached is not None:
+        return cached
+
+    response = await _dispatch_conversation(query, query_lower, store_name)
+    store_response(query_lower, response)
+    return response
+
+
+async def handle_conversation_stream(query: str, store_name: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of handle_conversation for the SSE endpoint.
+
+    Yields the product cards first so the frontend can render them
+    immediately, then the answer text in small deltas. The AI backend here is
+    still the local placeholder, so deltas are chunked from the finished
+    text; once a real streaming Claude client lands, its text_stream plugs
+    into the same contract.
+    """
+    response = await handle_conversation(query, store_name)
+    yield {"products": response.get("products", [])}
+
+    words = response.get("text", "").split(" ")
+    for i in range(0, len(words), 4):
+        yield {"delta": " ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "")}
+
+
+async def _dispatch_conversation(query: str, query_lower: str, store_name: str) -> Dict[str, Any]:
+    # Score the keyword evidence and route to the single most likely intent;
+    # low-confidence matches (a lone weak keyword in a long sentence) fall
+    # through to the general conversation branch instead of a wrong one.
+    intent, _confidence = classify_intent(query_lower)
 
     # --- 1. Intent: Greeting ---
-    if any(keyword in query_lower for keyword in GREETING_KEYWORDS):
+    if intent == "greeting":
         return {"text": "Hello! I'm V, your personal shopping assistant. What can I help you find today?",
                 "products": []}
 
     # --- 2. Intent: Order Tracking ---
-    if any(keyword in query_lower for keyword in ORDER_TRACKING_KEYWORDS):
-        order_number_match = re.search(r'(\d{4,})', query)
+    if intent == "order":
+        order_number_match = _ORDER_NUMBER_RE.search(query)
         if order_number_match:
             order_id = order_number_match.group(1)
             status = await track_order_in_shopify(order_id)
@@ -71,11 +98,10 @@ async def handle_conversation(query: str, store_name: str) -> Dict[str, Any]:
         return {"text": "I can certainly help with that! What is your order number?", "products": []}
 
     # --- 3. Intent: Policy Question (UPDATED) ---
-    if any(keyword in query_lower for keyword in POLICY_KEYWORDS):
-        # Determine which topic to search for
-        topic_to_find = "return"  # Default
-        if "shipping" in query_lower or "frakt" in query_lower:
-            topic_to_find = "shipping"
+    if intent == "policy":
+        # The automaton already resolved each policy keyword to its topic, so
+        # the branch only has to check which (intent, topic) pair matched.
+        topic_to_find = "shipping" if ("policy", "shipping") in match_intents(query_lower) else "return"
 
         # This now searches by topic title, not a fixed handle
         page_content_html = await get_shopify_page_by_handle(topic_to_find)
@@ -87,24 +113,26 @@ async def handle_conversation(query: str, store_name: str) -> Dict[str, Any]:
             return {"text": f"I couldn't find the specific details for our {topic_to_find} policy.", "products": []}
 
     # --- 4. Intent: Product Recommendation / Sales ---
-    if any(keyword in query_lower for keyword in RECOMMENDATION_KEYWORDS):
+    if intent == "recommendation":
         recommendations = await fetch_shopify_recommendations()
         if recommendations:
-            product = recommendations[0]
-            product_title = product.get("title")
-            product_url = product.get("product_url")
-            image_url = await scrape_product_image_url(product_url)
-
+            # The product fetch already includes each product's image URL,
+            # so the cards go out without any per-product page scraping.
+            product_title = recommendations[0].get("title")
             response_text = f"I have a great suggestion for you! The {product_title} is very popular. It might be just what you're looking for."
-            product_card = {"title": product_title, "product_url": product_url, "image_url": image_url or ""}
-            return {"text": response_text, "products": [product_card]}
+            product_cards = [
+                {"title": p.get("title"), "product_url": p.get("product_url"),
+                 "image_url": p.get("image_url", "")}
+                for p in recommendations
+            ]
+            return {"text": response_text, "products": product_cards}
 
     # --- 5. Default: Fallback to General Conversation AI ---
     try:
         ai_response = await get_conversational_response(query)
         return {"text": ai_response, "products": []}
-    except Exception as e:
-        print(f"ERROR: General AI conversation failed. {e}")
+    except Exception:
+        logger.exception("General AI conversation failed.")
         return {
             "text": "I'm sorry, I don't have information on that right now. Could I help with a product recommendation or a policy question instead?",
             "products": []}
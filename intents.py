@@ -0,0 +1,108 @@
+import functools
+import re
+import ahocorasick
+from typing import FrozenSet, Optional, Tuple
+
+# --- Keyword Definitions ---
+# frozenset: these tables are never mutated, and frozensets skip the rehash
+# a plain set literal pays on every import.
+GREETING_KEYWORDS = frozenset({"hej", "hi", "hello", "hey", "tja", "good morning", "good evening"})
+ORDER_TRACKING_KEYWORDS = frozenset({"track", "order", "spåra", "beställning", "where is my order", "status"})
+POLICY_KEYWORDS = frozenset({"policy", "return", "retur", "shipping", "frakt", "terms", "rules", "villkor"})
+RECOMMENDATION_KEYWORDS = frozenset({"recommend", "rekommendera", "suggest", "product", "produkt", "looking for"})
+
+# Policy keywords that should resolve to the shipping page; all others fall
+# back to the return policy.
+_SHIPPING_POLICY_KEYWORDS = frozenset({"shipping", "frakt"})
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Each matcher value is an (intent, policy_topic) tuple.
+IntentHit = Tuple[str, Optional[str]]
+
+
+def _keyword_values():
+    """Yields every (keyword, (intent, policy_topic)) pair across the sets."""
+    for keyword in GREETING_KEYWORDS:
+        yield keyword, ("greeting", None)
+    for keyword in ORDER_TRACKING_KEYWORDS:
+        yield keyword, ("order", None)
+    for keyword in POLICY_KEYWORDS:
+        topic = "shipping" if keyword in _SHIPPING_POLICY_KEYWORDS else "return"
+        yield keyword, ("policy", topic)
+    for keyword in RECOMMENDATION_KEYWORDS:
+        yield keyword, ("recommendation", None)
+
+
+def _build_intent_matchers():
+    """
+    Single-word keywords go into a dict matched against the query's token
+    set, so "reorder" no longer triggers the order intent via substring
+    matching. Multi-word phrases stay on an Aho-Corasick automaton so one
+    linear scan still covers them.
+    """
+    single_words = {}
+    phrase_automaton = ahocorasick.Automaton()
+    for keyword, value in _keyword_values():
+        if " " in keyword:
+            phrase_automaton.add_word(keyword, value)
+        else:
+            single_words[keyword] = value
+    phrase_automaton.make_automaton()
+    return single_words, phrase_automaton
+
+
+# Module-level singletons so construction cost is paid once at import time.
+_SINGLE_WORD_INTENTS, _PHRASE_AUTOMATON = _build_intent_matchers()
+
+
+@functools.lru_cache(maxsize=1024)
+def match_intents(query_lower: str) -> FrozenSet[IntentHit]:
+    """
+    Returns every (intent, policy_topic) hit for a lowercased query: a
+    token-set intersection for single words plus one automaton pass for
+    multi-word phrases.
+
+    Classification is pure, so results are memoized: repeated queries
+    ("hi", "track my order") skip the scan entirely.
+    """
+    tokens = set(_TOKEN_RE.findall(query_lower))
+    hits = {_SINGLE_WORD_INTENTS[token] for token in tokens & _SINGLE_WORD_INTENTS.keys()}
+    hits.update(value for _, value in _PHRASE_AUTOMATON.iter(query_lower))
+    return frozenset(hits)
+
+
+# Tie-breaking order when intents score equally; mirrors the historical
+# branch order in the conversation handler.
+_INTENT_PRIORITY = ("greeting", "order", "policy", "recommendation")
+
+# Minimum share of the query's tokens that must be keyword evidence. A lone
+# weak keyword in a long sentence ("I want to return to your store") falls
+# below this and routes to general conversation instead of a wrong branch.
+_MIN_CONFIDENCE = 0.15
+
+
+@functools.lru_cache(maxsize=1024)
+def classify_intent(query_lower: str) -> Tuple[Optional[str], float]:
+    """
+    Scores each intent by its keyword evidence and returns the best one with
+    a confidence value, or (None, confidence) when the evidence is too thin
+    relative to the query length. Phrase matches count double since they are
+    far stronger signals than single words.
+    """
+    tokens = _TOKEN_RE.findall(query_lower)
+    scores = {}
+    for token in set(tokens) & _SINGLE_WORD_INTENTS.keys():
+        intent, _ = _SINGLE_WORD_INTENTS[token]
+        scores[intent] = scores.get(intent, 0.0) + 1.0
+    for _, (intent, _) in _PHRASE_AUTOMATON.iter(query_lower):
+        scores[intent] = scores.get(intent, 0.0) + 2.0
+
+    if not scores:
+        return None, 0.0
+
+    best = max(scores, key=lambda intent: (scores[intent], -_INTENT_PRIORITY.index(intent)))
+    confidence = scores[best] / max(len(tokens), 1)
+    if confidence < _MIN_CONFIDENCE:
+        return None, confidence
+    return best, confidence
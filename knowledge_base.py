@@ -1,22 +1,129 @@
+import asyncio
+import logging
 import os
-import requests
+import httpx
+import ijson
+import orjson
 from typing import List, Dict, Any, Optional
 
+from cachetools import TTLCache
+
+import cache
+
+logger = logging.getLogger(__name__)
+
 # --- Configuration from Environment Variables ---
 SHOPIFY_STORE_URL = os.getenv("SHOPIFY_STORE_URL")
 SHOPIFY_ADMIN_API_TOKEN = os.getenv("SHOPIFY_ADMIN_API_TOKEN")
-API_VERSION = "2023-10"
+API_VERSION = "2026-01"
+
+# --- In-process TTL cache for slow-changing Shopify data ---
+# Short-lived L1 in front of the shared Redis cache: the Redis TTLs in
+# cache.py own the real freshness policy, this layer just absorbs per-worker
+# hot-path hits.
+_CACHE = TTLCache(maxsize=8, ttl=60)
+
+# Single-flight table: concurrent misses on the same key await one upstream
+# fetch instead of fanning out identical Shopify calls (thundering-herd
+# guard), while misses on different keys still proceed in parallel.
+_INFLIGHT: Dict[str, asyncio.Future] = {}
+
+# Casefolded title -> body_html for every page seen while streaming the
+# fallback scan, so a later lookup for a different topic can be answered
+# without refetching the listing. Shares the L1 lifetime.
+_TITLE_INDEX = TTLCache(maxsize=64, ttl=60)
+
+
+async def invalidate_cache() -> None:
+    """Drops all cached Shopify data (L1 and Redis); the next call refetches."""
+    _CACHE.clear()
+    _TITLE_INDEX.clear()
+    await cache.invalidate()
+
+
+async def _get_or_fetch(key: str, fetch):
+    """Returns the cached value for key, coalescing concurrent fetches."""
+    if key in _CACHE:
+        return _CACHE[key]
+
+    inflight = _INFLIGHT.get(key)
+    if inflight is not None:
+        return await inflight
+
+    future = asyncio.get_running_loop().create_future()
+    _INFLIGHT[key] = future
+    try:
+        result = await fetch()
+        if result:
+            _CACHE[key] = result
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        _INFLIGHT.pop(key, None)
+
+
+# --- Shared HTTP Client ---
+# One async client for all Admin REST calls (mirrors shopify_api.py): the
+# old synchronous requests.get blocked the event loop for each Shopify round
+# trip, and a fresh connection was opened per call. Keep-alive here amortizes
+# the TCP+TLS handshake across requests. main.py closes it on shutdown.
+_CLIENT = httpx.AsyncClient(
+    base_url=f"https://{SHOPIFY_STORE_URL}/admin/api/{API_VERSION}",
+    timeout=10.0,
+)
+
+
+async def close_http_client() -> None:
+    """Closes the shared client; called from the app's shutdown hook."""
+    if not _CLIENT.is_closed:
+        await _CLIENT.aclose()
+
+
+# Cap concurrent Admin API calls: Shopify throttles with a small leaky
+# bucket, so gathering more requests than this just trades latency for 429s.
+_SHOPIFY_SEMAPHORE = asyncio.Semaphore(5)
+
+
+async def _admin_get(path: str, **kwargs) -> httpx.Response:
+    """GET on the shared client, bounded by the per-host semaphore."""
+    async with _SHOPIFY_SEMAPHORE:
+        return await _CLIENT.get(path, **kwargs)
+
+
+class _AsyncByteReader:
+    """Adapts an httpx byte iterator to the async file API ijson expects."""
+
+    def __init__(self, aiter):
+        self._aiter = aiter
+
+    async def read(self, size: int) -> bytes:
+        # ijson probes with read(0) to sniff bytes vs text; returning the
+        # empty string there must not consume a chunk.
+        if size == 0:
+            return b""
+        try:
+            return await self._aiter.__anext__()
+        except StopAsyncIteration:
+            return b""
+
+
+# --- Headers for Shopify Admin API requests ---
+# Built once at import instead of per call; the helper keeps the per-request
+# missing-token error path.
+_ADMIN_HEADERS = {
+    "X-Shopify-Access-Token": SHOPIFY_ADMIN_API_TOKEN,
+    "Content-Type": "application/json"
+} if SHOPIFY_ADMIN_API_TOKEN else None
 
 
-# --- Helper to build headers for Shopify Admin API requests ---
 def _get_admin_api_headers():
     """Returns the required headers for Shopify Admin API calls."""
-    if not SHOPIFY_ADMIN_API_TOKEN:
+    if _ADMIN_HEADERS is None:
         raise ValueError("SHOPIFY_ADMIN_API_TOKEN is not set in the environment.")
-    return {
-        "X-Shopify-Access-Token": SHOPIFY_ADMIN_API_TOKEN,
-        "Content-Type": "application/json"
-    }
+    return _ADMIN_HEADERS
 
 
 # ==============================================================================
@@ -24,44 +131,84 @@ def _get_admin_api_headers():
 # ==============================================================================
 
 async def get_shopify_page_by_handle(topic: str) -> Optional[str]:
+    """
+    Returns the policy page for a topic, serving from the caches when warm.
+    """
+    return await _get_or_fetch(
+        f"page:{topic}",
+        lambda: cache.cached(f"shopify:page:{topic}", cache.CACHE_TTL_PAGES,
+                             lambda: _fetch_page_by_topic(topic)),
+    )
+
+
+async def _fetch_page_by_topic(topic: str) -> Optional[str]:
     """
     Fetches a policy page from Shopify.
     Instead of a fixed handle, it now searches for a page with the topic in its title.
     """
     if not SHOPIFY_STORE_URL:
-        print("ERROR: SHOPIFY_STORE_URL is not set.")
+        logger.error("SHOPIFY_STORE_URL is not set.")
         return None
 
-    url = f"https://{SHOPIFY_STORE_URL}/admin/api/{API_VERSION}/pages.json"
-
     try:
         headers = _get_admin_api_headers()
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+        # casefold() once up front: unlike lower(), it folds the full
+        # Unicode case table, which matters for Swedish page titles.
+        topic_cf = topic.casefold()
 
-        pages = response.json().get("pages", [])
+        # Cheap path first: ask Shopify for exactly one page by conventional
+        # handle ("return-policy", "shipping-policy") instead of downloading
+        # every page on the store. The GET is conditional: if the page has
+        # not changed since the TTL expired, Shopify answers 304 and the
+        # body comes from Redis.
+        content = await cache.conditional_get(
+            f"shopify:etag:page:{topic}",
+            lambda extra: _admin_get(
+                "/pages.json",
+                params={"handle": f"{topic}-policy", "fields": "title,body_html"},
+                headers={**headers, **extra},
+            ),
+        )
+        pages = orjson.loads(content).get("pages", [])
+        if pages:
+            logger.debug("Found page by handle '%s-policy'.", topic)
+            return pages[0].get("body_html", "")
 
-        # --- NEW: More robust search logic ---
-        print(f"DEBUG: Searching for a page with '{topic}' in the title...")
+        # Titles already seen in a previous scan answer without a refetch.
+        indexed = next(
+            (body_html for title_cf, body_html in _TITLE_INDEX.items() if topic_cf in title_cf),
+            None,
+        )
+        if indexed is not None:
+            return indexed
 
-        # Log all found page titles for easier debugging
-        all_titles = [page.get('title', '').lower() for page in pages]
-        print(f"DEBUG: Available page titles: {all_titles}")
+        # Fall back to a title scan. The response is streamed through ijson
+        # so pages are examined one at a time and the scan stops (and the
+        # download aborts) at the first match, instead of buffering and
+        # parsing the whole listing on stores with hundreds of pages.
+        logger.debug("Searching for a page with '%s' in the title...", topic)
 
-        for page in pages:
-            page_title = page.get("title", "").lower()
-            if topic in page_title:
-                print(f"DEBUG: Match found! Using page titled '{page.get('title')}'.")
-                return page.get("body_html", "")
+        async with _SHOPIFY_SEMAPHORE:
+            async with _CLIENT.stream(
+                "GET", "/pages.json", params={"fields": "title,body_html"}, headers=headers
+            ) as response:
+                response.raise_for_status()
+                reader = _AsyncByteReader(response.aiter_bytes())
+                async for page in ijson.items(reader, "pages.item"):
+                    page_title = page.get("title", "").casefold()
+                    _TITLE_INDEX[page_title] = page.get("body_html", "")
+                    if topic_cf in page_title:
+                        logger.debug("Match found! Using page titled '%s'.", page.get('title'))
+                        return page.get("body_html", "")
 
-        print(f"WARN: No page found with '{topic}' in the title.")
+        logger.warning("No page found with '%s' in the title.", topic)
         return None
 
-    except requests.RequestException as e:
-        print(f"ERROR: Failed to fetch Shopify pages. Details: {e}")
+    except httpx.HTTPError:
+        logger.exception("Failed to fetch Shopify pages.")
         return None
-    except Exception as e:
-        print(f"ERROR: An unexpected error occurred while fetching pages. {e}")
+    except Exception:
+        logger.exception("An unexpected error occurred while fetching pages.")
         return None
 
 
@@ -72,14 +219,17 @@ async def track_order_in_shopify(order_number: str) -> str:
     if not SHOPIFY_STORE_URL:
         return "I'm sorry, my connection to the store is currently unavailable."
 
-    url = f"https://{SHOPIFY_STORE_URL}/admin/api/{API_VERSION}/orders.json?name=#{order_number}&status=any"
-
     try:
         headers = _get_admin_api_headers()
-        response = requests.get(url, headers=headers, timeout=10)
+        response = await _admin_get(
+            "/orders.json",
+            params={"name": f"#{order_number}", "status": "any",
+                    "fields": "name,fulfillment_status"},
+            headers=headers,
+        )
         response.raise_for_status()
 
-        orders = response.json().get("orders", [])
+        orders = orjson.loads(response.content).get("orders", [])
         if not orders:
             return f"I couldn't find any order with the number #{order_number}. Please double-check the number."
 
@@ -95,38 +245,56 @@ async def track_order_in_shopify(order_number: str) -> str:
         else:
             return f"The current status for order #{order_number} is: {fulfillment_status}."
 
-    except requests.RequestException as e:
-        print(f"ERROR: Failed to track order in Shopify. Details: {e}")
+    except httpx.HTTPError:
+        logger.exception("Failed to track order in Shopify.")
         return "I'm having trouble accessing order information right now. Please try again in a moment."
 
 
 async def fetch_shopify_recommendations() -> List[Dict[str, Any]]:
+    """
+    Returns a few products to recommend, serving from the caches when warm.
+    """
+    return await _get_or_fetch(
+        "active_products",
+        lambda: cache.cached("shopify:recommendations", cache.CACHE_TTL_RECOMMENDATIONS,
+                             _fetch_recommendations),
+    )
+
+
+async def _fetch_recommendations() -> List[Dict[str, Any]]:
     """
     Fetches a few published products from Shopify to use as recommendations.
     """
     if not SHOPIFY_STORE_URL:
-        print("ERROR: SHOPIFY_STORE_URL is not set.")
+        logger.error("SHOPIFY_STORE_URL is not set.")
         return []
 
-    url = f"https://{SHOPIFY_STORE_URL}/admin/api/{API_VERSION}/products.json?status=active&limit=3"
-
     try:
         headers = _get_admin_api_headers()
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-
-        products_data = response.json().get("products", [])
+        content = await cache.conditional_get(
+            "shopify:etag:products",
+            lambda extra: _admin_get(
+                "/products.json",
+                params={"status": "active", "limit": 3,
+                        "fields": "title,handle,image"},
+                headers={**headers, **extra},
+            ),
+        )
+        products_data = orjson.loads(content).get("products", ())
 
-        recommendations = []
-        for prod in products_data:
-            recommendations.append({
+        base = f"https://{SHOPIFY_STORE_URL}/products"
+        recommendations = [
+            {
                 "title": prod.get("title"),
-                "product_url": f"https://{SHOPIFY_STORE_URL}/products/{prod.get('handle')}"
-            })
+                "product_url": f"{base}/{prod.get('handle')}",
+                "image_url": (prod.get("image") or {}).get("src", ""),
+            }
+            for prod in products_data
+        ]
 
-        print(f"DEBUG: Fetched {len(recommendations)} products for recommendation.")
+        logger.debug("Fetched %d products for recommendation.", len(recommendations))
         return recommendations
 
-    except requests.RequestException as e:
-        print(f"ERROR: Failed to fetch Shopify products. Details: {e}")
+    except httpx.HTTPError:
+        logger.exception("Failed to fetch Shopify products.")
         return []
\ No newline at end of file
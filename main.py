@@ -1,14 +1,22 @@
+import asyncio
+import json
+import logging
+import logging.handlers
 import os
+import queue
+import httpx
 import uvicorn
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
 from pydantic import BaseModel
-import requests
 
 # --- Simplified Imports ---
 # We only need the main conversation handler.
-from conversation_manager import handle_conversation
+import cache
+import knowledge_base
+from conversation_manager import handle_conversation, handle_conversation_stream
+from knowledge_base import invalidate_cache
 
 
 # --- Pydantic Model for POST Request Body ---
@@ -16,8 +24,28 @@ class ChatRequest(BaseModel):
     query: str
 
 
+# --- Logging ---
+# Handlers go through a queue so log I/O happens on a background thread
+# instead of stalling the event loop mid-request.
+def _configure_logging() -> None:
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+_configure_logging()
+logger = logging.getLogger(__name__)
+
 # --- App Initialization ---
-app = FastAPI()
+# orjson serializes the nested product payloads several times faster than
+# stdlib json, so it is the default response class for every endpoint.
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # --- State ---
 STORE_NAME = "V's Store"
@@ -32,35 +60,69 @@ app.add_middleware(
 )
 
 
-# --- Startup Event ---
-@app.on_event("startup")
-async def startup_event():
-    """On startup, fetch the store name from the Shopify Admin API."""
-    global STORE_NAME
-    try:
-        store_url = os.getenv("SHOPIFY_STORE_URL")
-        admin_token = os.getenv("SHOPIFY_ADMIN_API_TOKEN")
-        api_version = "2023-10"
+async def _warm_knowledge_cache():
+    """Prefetches the data the first chat turns will need, in parallel."""
+    from knowledge_base import fetch_shopify_recommendations, get_shopify_page_by_handle
+    results = await asyncio.gather(
+        get_shopify_page_by_handle("return"),
+        get_shopify_page_by_handle("shipping"),
+        fetch_shopify_recommendations(),
+        return_exceptions=True,
+    )
+    warmed = sum(1 for r in results if r and not isinstance(r, Exception))
+    logger.info("Cache warmup complete (%d/%d entries).", warmed, len(results))
+
 
-        if not all([store_url, admin_token]):
-            raise ValueError("Shopify environment variables are not fully set.")
+async def _refresh_store_name():
+    """Fetches the store name from Shopify, retrying with backoff."""
+    global STORE_NAME
+    store_url = os.getenv("SHOPIFY_STORE_URL")
+    admin_token = os.getenv("SHOPIFY_ADMIN_API_TOKEN")
+    api_version = "2026-01"
+
+    if not all([store_url, admin_token]):
+        logger.error("Shopify environment variables are not fully set. Using fallback store name.")
+        return
+
+    url = f"https://{store_url}/admin/api/{api_version}/shop.json?fields=name"
+    headers = {
+        "X-Shopify-Access-Token": admin_token,
+        "Content-Type": "application/json"
+    }
+
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        for attempt in range(4):
+            try:
+                response = await client.get(url, headers=headers)
+                response.raise_for_status()
+                shop_data = response.json().get("shop", {})
+                STORE_NAME = shop_data.get("name", "V's Store")
+                logger.info("Successfully fetched store name: %s", STORE_NAME)
+                return
+            except Exception:
+                logger.warning("Store name fetch failed (attempt %d).", attempt + 1)
+                if attempt < 3:
+                    await asyncio.sleep(2 ** attempt)
+    logger.error("Failed to fetch store name after retries. Using fallback.")
 
-        url = f"https://{store_url}/admin/api/{api_version}/shop.json"
-        headers = {
-            "X-Shopify-Access-Token": admin_token,
-            "Content-Type": "application/json"
-        }
 
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+# --- Startup Event ---
+@app.on_event("startup")
+async def startup_event():
+    """Kicks off the background warmup; the server is ready immediately."""
+    # The store-name fetch and cache warmup run as background tasks, so a
+    # slow Shopify cannot delay readiness; endpoints serve with the
+    # fallback STORE_NAME until the fetch lands.
+    asyncio.create_task(_refresh_store_name())
+    asyncio.create_task(_warm_knowledge_cache())
 
-        shop_data = response.json().get("shop", {})
-        STORE_NAME = shop_data.get("name", "V's Store")
-        print(f"Successfully fetched store name: {STORE_NAME}")
 
-    except Exception as e:
-        print(f"CRITICAL: Failed to fetch store name on startup. Using fallback. Error: {repr(e)}")
-        STORE_NAME = "V's Store"
+# --- Shutdown Event ---
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Closes the shared HTTP clients and the Redis pool."""
+    await knowledge_base.close_http_client()
+    await cache.close_redis()
 
 
 # --- API Endpoints ---
@@ -83,15 +145,54 @@ async def chat_with_v(request: ChatRequest):
         response_data = await handle_conversation(query, STORE_NAME)
         return {"response": response_data}
     except Exception as e:
-        import traceback
-        print(f"ERROR in /chat endpoint: {e}")
-        print(traceback.format_exc())
+        logger.exception("Unhandled error in /chat endpoint")
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
+@app.post("/chat/stream")
+async def chat_with_v_stream(request: ChatRequest):
+    """
+    Streaming chat endpoint: product cards first, then text deltas over SSE,
+    so the client can start rendering before the full answer is generated.
+    """
+    query = request.query
+    if not query:
+        raise HTTPException(status_code=400, detail="Query in request body cannot be empty.")
+
+    async def event_stream():
+        try:
+            async for event in handle_conversation_stream(query, STORE_NAME):
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception:
+            logger.exception("Unhandled error in /chat/stream endpoint")
+            yield f"data: {json.dumps({'error': 'An error occurred.'})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.post("/cache/invalidate")
+async def invalidate_knowledge_cache():
+    """Drops the cached Shopify pages/products so the next query refetches."""
+    await invalidate_cache()
+    return {"message": "Cache invalidated."}
+
+
 # --- Obsolete endpoints from the old version have been removed ---
 
 # --- Main Execution Block ---
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
+    if os.getenv("ENV") == "dev":
+        uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
+    else:
+        # Production: libuv event loop, C HTTP parser, and one worker per
+        # core (overridable via WEB_CONCURRENCY) instead of the single
+        # auto-reloading dev server.
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=port,
+            workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+            loop="uvloop",
+            http="httptools",
+        )
\ No newline at end of file
@@ -0,0 +1,81 @@
+import logging
+import re
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Tunables ---
+# Minimum token-set similarity for a cached answer to be reused.
+# 0.92 is deliberately strict so paraphrases hit but different intents don't.
+SIMILARITY_THRESHOLD = 0.92
+CACHE_TTL_SECONDS = 300
+CACHE_MAX_ENTRIES = 256
+
+# Queries containing a long digit run are order lookups — their answers are
+# per-customer, so they must never be cached.
+_ORDER_NUMBER_RE = re.compile(r"\d{4,}")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Each entry: (token_set, response_dict, expires_at)
+_cache: Dict[str, tuple] = {}
+
+
+def _tokenize(query: str) -> frozenset:
+    """Normalizes a query into its set of word tokens."""
+    return frozenset(_WORD_RE.findall(query))
+
+
+def _similarity(a: frozenset, b: frozenset) -> float:
+    """Jaccard similarity between two token sets (0.0 - 1.0)."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def get_cached_response(query_lower: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns a previously stored response if a near-duplicate query is cached.
+
+    Compares the query's token set against every live entry and returns the
+    best match above SIMILARITY_THRESHOLD, or None on a miss.
+    """
+    tokens = _tokenize(query_lower)
+    if not tokens:
+        return None
+
+    now = time.monotonic()
+    best_response = None
+    best_score = SIMILARITY_THRESHOLD
+
+    for key in list(_cache):
+        entry_tokens, response, expires_at = _cache[key]
+        if expires_at <= now:
+            del _cache[key]
+            continue
+        score = _similarity(tokens, entry_tokens)
+        if score >= best_score:
+            best_score = score
+            best_response = response
+
+    if best_response is not None:
+        logger.debug("Semantic cache hit (similarity %.2f).", best_score)
+    return best_response
+
+
+def store_response(query_lower: str, response: Dict[str, Any]) -> None:
+    """
+    Stores a response keyed by the query's token set, unless the query looks
+    like an order lookup (those answers are customer-specific).
+    """
+    if _ORDER_NUMBER_RE.search(query_lower):
+        return
+    tokens = _tokenize(query_lower)
+    if not tokens:
+        return
+
+    if len(_cache) >= CACHE_MAX_ENTRIES:
+        # Drop the oldest entry; insertion order doubles as age order.
+        _cache.pop(next(iter(_cache)), None)
+
+    _cache[" ".join(sorted(tokens))] = (tokens, response, time.monotonic() + CACHE_TTL_SECONDS)
@@ -1,14 +1,25 @@
+import asyncio
+import atexit
+import logging
 import os
 import httpx
-from dotenv import load_dotenv
+import msgspec
+
+import cache
 
 # --- Load Environment Variables & API Configuration ---
-load_dotenv()
+# .env files are a local-dev convenience; deployed environments set real
+# env vars, so skip the dotenv import and file probe entirely there.
+if os.path.exists(".env"):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+logger = logging.getLogger(__name__)
 
 SHOPIFY_ADMIN_API_TOKEN = os.getenv("SHOPIFY_ADMIN_API_TOKEN")
 SHOPIFY_STOREFRONT_API_TOKEN = os.getenv("SHOPIFY_STOREFRONT_API_TOKEN")
 SHOPIFY_STORE_URL = os.getenv("SHOPIFY_STORE_URL")
-API_VERSION = "2024-07"  # Using a fixed API version for stability
+API_VERSION = "2026-01"  # Using a fixed API version for stability
 
 # --- Validate Environment Variables ---
 if not all([SHOPIFY_ADMIN_API_TOKEN, SHOPIFY_STOREFRONT_API_TOKEN, SHOPIFY_STORE_URL]):
@@ -24,141 +35,326 @@ STOREFRONT_API_HEADERS = {
     "Content-Type": "application/json"
 }
 
+# --- Shared HTTP Client ---
+# One pooled client for all Shopify calls: the TLS handshake is paid once and
+# HTTP/2 multiplexes concurrent requests over the same connection, instead of
+# opening (and tearing down) a fresh connection per call.
+_HTTP = httpx.AsyncClient(
+    base_url=SHOPIFY_STORE_URL,
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+    timeout=10.0,
+)
+
+
+async def close_http_client() -> None:
+    """Closes the shared client; call this from the app's shutdown hook."""
+    if not _HTTP.is_closed:
+        await _HTTP.aclose()
+
+
+def _close_http_client_at_exit() -> None:
+    if not _HTTP.is_closed:
+        asyncio.run(_HTTP.aclose())
+
+
+atexit.register(_close_http_client_at_exit)
+
+# Request paths formatted once at import instead of per call.
+_SHOP_JSON_PATH = f"/admin/api/{API_VERSION}/shop.json"
+_ADMIN_GRAPHQL_PATH = f"/admin/api/{API_VERSION}/graphql.json"
+_STOREFRONT_GRAPHQL_PATH = f"/api/{API_VERSION}/graphql.json"
+
+
+# --- Typed response shapes ---
+# msgspec decodes straight into these structs, materializing only the fields
+# we actually read instead of a full dict tree per response.
+
+class _Shop(msgspec.Struct):
+    name: str = "Unknown Store"
+
+
+class _ShopResp(msgspec.Struct):
+    shop: _Shop = msgspec.field(default_factory=_Shop)
+
+
+class _GraphQLResp(msgspec.Struct):
+    data: dict = msgspec.field(default_factory=dict)
+
+
+# Storefront search response, mirrored field for field so the decoder
+# validates the shape once and the formatter is plain attribute access.
+
+class _Money(msgspec.Struct):
+    amount: str = "0.0"
+    currencyCode: str = ""
+
+
+class _PriceRange(msgspec.Struct):
+    minVariantPrice: _Money | None = None
+
+
+class _Image(msgspec.Struct):
+    originalSrc: str | None = None
+
+
+class _ImageEdge(msgspec.Struct):
+    node: _Image = msgspec.field(default_factory=_Image)
+
+
+class _ImageConnection(msgspec.Struct):
+    edges: list[_ImageEdge] = msgspec.field(default_factory=list)
+
+
+class _ProductNode(msgspec.Struct):
+    id: str | None = None
+    title: str | None = None
+    handle: str | None = None
+    priceRange: _PriceRange = msgspec.field(default_factory=_PriceRange)
+    images: _ImageConnection = msgspec.field(default_factory=_ImageConnection)
+
+
+class _ProductEdge(msgspec.Struct):
+    node: _ProductNode = msgspec.field(default_factory=_ProductNode)
+
+
+class _ProductConnection(msgspec.Struct):
+    edges: list[_ProductEdge] = msgspec.field(default_factory=list)
+
+
+class _SearchData(msgspec.Struct):
+    products: _ProductConnection = msgspec.field(default_factory=_ProductConnection)
+
+
+class _SearchResp(msgspec.Struct):
+    data: _SearchData = msgspec.field(default_factory=_SearchData)
+
 
 # --- Internal Helper Functions ---
 
-def _format_product_data(node: dict) -> dict:
+def _format_product_data(node: _ProductNode) -> dict:
     """Creates a consistent product object for the frontend."""
-    image_edge = node.get('images', {}).get('edges', [{}])[0]
-    image = image_edge.get('node', {})
-
-    # Safely access nested price data
     price = "N/A"
-    if 'priceRange' in node and 'minVariantPrice' in node['priceRange']:
-        price_info = node['priceRange']['minVariantPrice']
-        price = f"{price_info.get('amount', '0.0')} {price_info.get('currencyCode', '')}"
+    if node.priceRange.minVariantPrice is not None:
+        price_info = node.priceRange.minVariantPrice
+        price = f"{price_info.amount} {price_info.currencyCode}"
+
+    image = node.images.edges[0].node if node.images.edges else _Image()
 
     return {
-        "id": node.get('id'),
-        "title": node.get('title'),
+        "id": node.id,
+        "title": node.title,
         "price": price,
-        "image": image.get('originalSrc'),
-        "url": f"{SHOPIFY_STORE_URL}/products/{node.get('handle')}"
+        "image": image.originalSrc,
+        "url": f"{SHOPIFY_STORE_URL}/products/{node.handle}"
     }
 
 
 # --- Admin API Functions ---
 
 async def get_store_name_admin() -> str:
-    """Fetches the store's name using the Admin API."""
-    api_url = f"{SHOPIFY_STORE_URL}/admin/api/{API_VERSION}/shop.json"
-
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(api_url, headers=ADMIN_API_HEADERS)
-            response.raise_for_status()
-            shop_data = response.json().get('shop', {})
-            return shop_data.get('name', "Unknown Store")
-        except httpx.HTTPStatusError as e:
-            # Using repr() for safe error logging
-            print(f"ERROR: Failed to fetch store name from Admin API. Status: {repr(e)}")
-            return "Fallback Store Name"
-        except Exception as e:
-            print(f"ERROR: An unexpected error occurred fetching store name: {repr(e)}")
-            return "Fallback Store Name"
+    """Fetches the store's name using the Admin API, cached for an hour."""
+    return await cache.cached("shopify:store_name", cache.CACHE_TTL_STORE_NAME, _fetch_store_name)
+
+
+async def _fetch_store_name() -> str:
+    try:
+        content = await cache.conditional_get(
+            "shopify:etag:shop",
+            lambda extra: _HTTP.get(_SHOP_JSON_PATH, params={"fields": "name"},
+                                    headers={**ADMIN_API_HEADERS, **extra}),
+        )
+        return msgspec.json.decode(content, type=_ShopResp).shop.name
+    except httpx.HTTPStatusError as e:
+        logger.error("Failed to fetch store name from Admin API: %r", e)
+        return "Fallback Store Name"
+    except Exception as e:
+        logger.error("An unexpected error occurred fetching store name: %r", e)
+        return "Fallback Store Name"
+
+
+# Projection of exactly the three fields the bot reads; the REST endpoint
+# returned the whole order envelope (line items, addresses, payments).
+_ORDER_STATUS_FIELDS = """
+  edges {
+    node {
+      name
+      displayFulfillmentStatus
+      fulfillments(first: 1) {
+        trackingInfo(first: 1) { url }
+      }
+    }
+  }
+"""
+
+_TRACK_ORDER_QUERY = f"""
+query trackOrder($orderQuery: String!) {{
+  orders(first: 1, query: $orderQuery) {{{_ORDER_STATUS_FIELDS}}}
+}}
+"""
+
+
+def _order_status_from_edges(edges: list, order_id: str) -> dict:
+    """Maps a projected orders connection onto the tracking response shape."""
+    if not edges:
+        return {"error": f"Order {order_id} not found."}
+
+    node = edges[0].get('node', {})
+    status = (node.get('displayFulfillmentStatus') or 'UNFULFILLED').lower()
+
+    tracking_url = None
+    if status == 'fulfilled':
+        fulfillments = node.get('fulfillments') or [{}]
+        tracking_info = fulfillments[0].get('trackingInfo') or [{}]
+        tracking_url = tracking_info[0].get('url')
+
+    return {
+        "order_number": node.get('name'),
+        "fulfillment_status": status,
+        "tracking_url": tracking_url
+    }
 
 
 async def track_order_admin(order_id: str) -> dict:
     """
-    Fetches order status for a given order ID/name using the Admin API.
+    Fetches order status for a given order ID/name using the Admin GraphQL
+    API, selecting only the name, fulfillment status, and tracking URL.
     Returns a dictionary with status information.
     """
     clean_order_id = order_id.lstrip('#')
-    api_url = f"{SHOPIFY_STORE_URL}/admin/api/{API_VERSION}/orders.json?name={clean_order_id}&status=any"
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(api_url, headers=ADMIN_API_HEADERS)
-            response.raise_for_status()
-            orders = response.json().get('orders', [])
+    data = await shopify_graphql(_TRACK_ORDER_QUERY, {"orderQuery": f"name:#{clean_order_id}"})
+    if not data:
+        return {"error": "Could not connect to the order system."}
 
-            if not orders:
-                return {"error": f"Order {order_id} not found."}
+    return _order_status_from_edges(data.get('orders', {}).get('edges', []), order_id)
 
-            order = orders[0]
-            status = order.get('fulfillment_status') or 'unfulfilled'
 
-            return {
-                "order_number": order.get('name'),
-                "fulfillment_status": status,
-                "tracking_url": order.get('fulfillments', [{}])[0].get(
-                    'tracking_url') if status == 'fulfilled' else None
-            }
-        except httpx.HTTPStatusError as e:
-            # Using repr() for safe error logging
-            print(f"ERROR: Failed to track order from Admin API. Status: {repr(e)}")
-            return {"error": "Could not connect to the order system."}
-        except Exception as e:
-            # Using repr() for safe error logging
-            print(f"ERROR: An unexpected error occurred tracking order: {repr(e)}")
-            return {"error": "An unexpected error occurred."}
+async def track_orders_admin(order_ids: list) -> dict:
+    """
+    Batched variant: looks up several orders in one GraphQL request using
+    aliased sub-queries, and returns a dict keyed by the given order IDs.
+    """
+    clean_ids = [order_id.lstrip('#') for order_id in order_ids]
+    aliases = "\n".join(
+        f'o{i}: orders(first: 1, query: "name:#{clean_id}") {{{_ORDER_STATUS_FIELDS}}}'
+        for i, clean_id in enumerate(clean_ids)
+    )
 
+    data = await shopify_graphql(f"query trackOrders {{\n{aliases}\n}}")
+    if not data:
+        return {order_id: {"error": "Could not connect to the order system."} for order_id in order_ids}
 
-# --- Storefront API Functions ---
+    return {
+        order_id: _order_status_from_edges(data.get(f'o{i}', {}).get('edges', []), order_id)
+        for i, order_id in enumerate(order_ids)
+    }
 
-async def search_products_storefront(query: str) -> list:
+
+async def shopify_graphql(query: str, variables: dict | None = None) -> dict:
     """
-    Searches for products using the Storefront API (GraphQL) and limits to 3 results.
+    Runs a query against the Admin GraphQL API on the shared client.
+    Returns the 'data' payload, or an empty dict on failure.
+    """
+    try:
+        response = await _HTTP.post(
+            _ADMIN_GRAPHQL_PATH,
+            headers=ADMIN_API_HEADERS,
+            json={"query": query, "variables": variables or {}},
+        )
+        response.raise_for_status()
+        return msgspec.json.decode(response.content, type=_GraphQLResp).data
+    except httpx.HTTPStatusError as e:
+        logger.error("Admin GraphQL query failed: %r", e)
+        return {}
+    except Exception as e:
+        logger.error("An unexpected error occurred in Admin GraphQL query: %r", e)
+        return {}
+
+
+# Aliased query so one POST covers every intent a single chat turn can hit:
+# order status, policy pages, and active products in one round trip instead
+# of three REST calls.
+_CONVERSATION_CONTEXT_QUERY = """
+query conversationContext($orderQuery: String!) {
+  orders(first: 1, query: $orderQuery) {
+    edges { node { name displayFulfillmentStatus } }
+  }
+  shop {
+    shopPolicies { title body }
+  }
+  products(first: 10, query: "status:active") {
+    edges { node { title handle } }
+  }
+}
+"""
+
+
+async def fetch_conversation_context(order_number: str) -> dict:
+    """
+    Fetches order status, shop policies, and active products in a single
+    GraphQL round trip, for turns where intents overlap.
     """
-    api_url = f"{SHOPIFY_STORE_URL}/api/{API_VERSION}/graphql.json"
-
-    graphql_query = {
-        "query": """
-        query searchProducts($query: String!) {
-          products(first: 3, query: $query) {
-            edges {
-              node {
-                id
-                title
-                handle
-                priceRange {
-                  minVariantPrice {
-                    amount
-                    currencyCode
-                  }
-                }
-                images(first: 1) {
-                  edges {
-                    node {
-                      originalSrc
-                      altText
-                    }
-                  }
-                }
-              }
+    data = await shopify_graphql(
+        _CONVERSATION_CONTEXT_QUERY,
+        {"orderQuery": f"name:#{order_number.lstrip('#')}"},
+    )
+
+    order_edges = data.get('orders', {}).get('edges', [])
+    return {
+        "order": order_edges[0].get('node') if order_edges else None,
+        "policies": data.get('shop', {}).get('shopPolicies', []),
+        "products": [edge.get('node', {}) for edge in data.get('products', {}).get('edges', [])],
+    }
+
+
+# --- Storefront API Functions ---
+
+_SEARCH_QUERY = """
+query searchProducts($query: String!) {
+  products(first: 3, query: $query) {
+    edges {
+      node {
+        id
+        title
+        handle
+        priceRange {
+          minVariantPrice {
+            amount
+            currencyCode
+          }
+        }
+        images(first: 1) {
+          edges {
+            node {
+              originalSrc
+              altText
             }
           }
         }
-        """,
-        "variables": {"query": query}
+      }
     }
+  }
+}
+"""
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(api_url, headers=STOREFRONT_API_HEADERS, json=graphql_query)
-            response.raise_for_status()
-            data = response.json()
-
-            products = []
-            for edge in data.get('data', {}).get('products', {}).get('edges', []):
-                node = edge.get('node', {})
-                products.append(_format_product_data(node))
-            return products
-        except httpx.HTTPStatusError as e:
-            # Using repr() for safe error logging
-            print(f"ERROR: Failed to search products from Storefront API. Status: {repr(e)}")
-            return []
-        except Exception as e:
-            # Using repr() for safe error logging
-            print(f"ERROR: An unexpected error occurred searching products: {repr(e)}")
-            return []
\ No newline at end of file
+
+async def search_products_storefront(query: str) -> list:
+    """
+    Searches for products using the Storefront API (GraphQL) and limits to 3 results.
+    """
+    try:
+        response = await _HTTP.post(
+            _STOREFRONT_GRAPHQL_PATH,
+            headers=STOREFRONT_API_HEADERS,
+            json={"query": _SEARCH_QUERY, "variables": {"query": query}},
+        )
+        response.raise_for_status()
+        data = msgspec.json.decode(response.content, type=_SearchResp).data
+        return [_format_product_data(edge.node) for edge in data.products.edges]
+    except httpx.HTTPStatusError as e:
+        logger.error("Failed to search products from Storefront API: %r", e)
+        return []
+    except Exception as e:
+        logger.error("An unexpected error occurred searching products: %r", e)
+        return []
\ No newline at end of file